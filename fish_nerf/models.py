@@ -8,6 +8,12 @@ import pypose as pp
 from image_resampling.mvs_utils.camera_models import LinearSphere
 from image_resampling.mvs_utils.shape_struct import ShapeStruct
 
+# Optional dependency, only required by the hash grid radiance field.
+try:
+    import tinycudann as tcnn
+except ImportError:
+    tcnn = None
+
 # ------------------------- Helper Modules ------------------------- #
 
 
@@ -110,6 +116,18 @@ def do_xavier(layer):
     torch.nn.init.xavier_uniform_(layer.weight.data)
 
 
+def cast_linear_weights(module, dtype):
+    # Store the weights of all the linear layers in reduced precision, for
+    # inference only. The module must then run under autocast with the same
+    # dtype, which no longer has to cast the weights on every call. Other
+    # layers and buffers (e.g. the harmonic frequencies) stay in full precision.
+    for layer in module.modules():
+        if isinstance(layer, nn.Linear):
+            layer.to(dtype)
+
+    return module
+
+
 # ------------------------- Actual Models ------------------------- #
 
 
@@ -182,6 +200,60 @@ class NeuralRadianceField(nn.Module):
         return final
 
 
+class HashGridRadianceField(nn.Module):
+    """Instant-NGP style radiance field backed by tiny-cuda-nn.
+
+    The hash grid encoding and the fully fused MLP run as fused CUDA kernels, rather than a chain of separate PyTorch ops. Colors are view independent.
+    """
+    def __init__(
+        self,
+        cfg,
+    ):
+        super().__init__()
+
+        if tcnn is None:
+            raise ImportError("The 'ngp' implicit function requires tiny-cuda-nn (https://github.com/NVlabs/tiny-cuda-nn).")
+
+        # Scene bounds as [x_min, y_min, z_min, x_max, y_max, z_max]. The hash grid expects inputs in [0, 1].
+        self.register_buffer("aabb", torch.tensor(cfg.aabb, dtype=torch.float32), persistent=False)
+
+        self.field = tcnn.NetworkWithInputEncoding(
+            n_input_dims=3,
+            n_output_dims=4,
+            encoding_config={
+                "otype": "HashGrid",
+                "n_levels": cfg.n_levels if "n_levels" in cfg else 16,
+                "n_features_per_level": 2,
+                "log2_hashmap_size": cfg.log2_hashmap_size if "log2_hashmap_size" in cfg else 19,
+                "base_resolution": 16,
+                "per_level_scale": 1.5,
+            },
+            network_config={
+                "otype": "FullyFusedMLP",
+                "activation": "ReLU",
+                "output_activation": "None",
+                "n_neurons": 64,
+                "n_hidden_layers": 2,
+            },
+        )
+
+    def forward(self, ray_bundle: RayBundle):
+        # Get points, normalized to the scene bounds
+        points = ray_bundle.sample_points.view(-1, 3)
+        points = (points - self.aabb[:3]) / (self.aabb[3:] - self.aabb[:3])
+        inside = ((points >= 0.0) & (points <= 1.0)).all(dim=-1, keepdim=True)
+
+        # tiny-cuda-nn outputs half precision
+        out = self.field(points).float()
+        density = F.relu(out[..., :1]) * inside
+        features = torch.sigmoid(out[..., 1:])
+
+        return {
+            "density": density,
+            "feature": features,
+        }
+
+
 # https://github.com/ActiveVisionLab/nerfmm/blob/main/models/poses.py
 class PoseModel(nn.Module):
     def __init__(self, num_cams, train_R, train_t, init_c2w=None):
@@ -237,6 +309,25 @@ class LinearSphereModel(nn.Module):
             torch.tensor(1.0, dtype=torch.float32), requires_grad=req_grad
         )  # (1, )
 
+        # The camera model object, cached when the intrinsics are fixed.
+        self._fish = None
+
+        # Cache the valid pixels of the image once. The valid region of a linear sphere is the inscribed image circle, which is set by the image shape and not by the fov, so it stays valid while the intrinsics are trained. Shapes are (2, V), where V is the number of valid pixels.
+        with torch.no_grad():
+            fish = self.model
+            valid_mask = fish.get_valid_mask()
+            pixel_coords = fish.pixel_coordinates(shift=0, normalized=False, flatten=False)
+            xy_coords = fish.pixel_coordinates(shift=0, normalized=True, flatten=False)
+
+        self.register_buffer("valid_mask", valid_mask == 1, persistent=False) # (W, H)
+        self.register_buffer("valid_mask_flat_idx", self.valid_mask.reshape(-1).nonzero().squeeze(-1), persistent=False) # (V,), to scatter into flattened (W * H) images.
+        self.register_buffer("valid_pixel_coords", pixel_coords[:, valid_mask == 1].to(dtype=torch.int32), persistent=False)
+        self.register_buffer("valid_xy_coords", xy_coords[:, valid_mask == 1], persistent=False)
+
+        # With fixed intrinsics, the ray of every pixel never changes, so cache them all as a lookup table. With trained intrinsics the rays depend on the fov, and are computed on the fly.
+        self.register_buffer("ray_dirs_cam", None, persistent=False)
+        self.register_buffer("ray_valid_cam", None, persistent=False)
+        self._build_ray_table()
 
     def forward(self):
         # Rather than use additive delta here, NeRF-- uses a scale squared
@@ -244,14 +335,53 @@ class LinearSphereModel(nn.Module):
 
     @property
     def model(self):
+        # With trained intrinsics, the camera model is rebuilt from the current fov (and its graph) on every access. Otherwise it is only built once per device.
+        if self._fish is not None and not self.delta.requires_grad and self._fish.device == self.delta.device:
+            return self._fish
+
         fish = LinearSphere(
             fov_degree = self.forward(), 
             shape_struct = ShapeStruct(256, 256),
             in_to_tensor=False, 
             out_to_numpy=False)
         fish.device = self.delta.device
+        self._fish = fish
         return fish
 
+    def pixel_2_ray(self, pixel_coords):
+        # Same interface as the camera model objects: (2, N) pixel coordinates to (3, N) rays in the camera frame, and their validity.
+        if self.ray_dirs_cam is None:
+            return self.model.pixel_2_ray(pixel_coords)
+
+        lin_idx = pixel_coords[1].long() * self.model.ss.W + pixel_coords[0].long()
+        return self.ray_dirs_cam[:, lin_idx], self.ray_valid_cam[lin_idx]
+
+    def _build_ray_table(self):
+        # Lookup table of the rays of all the pixels, indexed by y * W + x, from the current fov. Shapes are (3, H * W) and (H * W,). Only built when the intrinsics are fixed.
+        self.ray_dirs_cam, self.ray_valid_cam = None, None
+        if self.delta.requires_grad:
+            return
+
+        with torch.no_grad():
+            fish = self.model
+            all_coords = fish.pixel_coordinates(shift=0, normalized=False, flatten=False).reshape(2, -1)
+            all_rays, all_valid = fish.pixel_2_ray(all_coords)
+
+            lin_idx = all_coords[1].long() * fish.ss.W + all_coords[0].long()
+            ray_dirs_cam = torch.zeros((3, fish.ss.H * fish.ss.W), dtype=all_rays.dtype, device=all_rays.device)
+            ray_dirs_cam[:, lin_idx] = all_rays
+            ray_valid_cam = torch.zeros((fish.ss.H * fish.ss.W,), dtype=all_valid.dtype, device=all_valid.device)
+            ray_valid_cam[lin_idx] = all_valid.reshape(-1)
+
+        self.ray_dirs_cam, self.ray_valid_cam = ray_dirs_cam, ray_valid_cam
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        # Loading may change the fov, so drop the cached camera model, and rebuild the ray lookup table from the loaded fov.
+        self._fish = None
+        super()._load_from_state_dict(*args, **kwargs)
+        self._build_ray_table()
+
 volume_dict = {
     "nerf": NeuralRadianceField,
+    "ngp": HashGridRadianceField,
 }
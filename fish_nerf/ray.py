@@ -1,3 +1,4 @@
+import os
 import torch
 import torch.nn.functional as F
 
@@ -121,42 +122,41 @@ def get_pixels_from_image(camera, filter_valid=True):
 
 
 # Random subsampling of pixels from an image
-def get_random_pixels_from_image(n_pixels, image_size, camera):
-    # xy_grid = get_pixels_from_image(image_size, camera)
+def get_random_pixels_from_image(n_pixels, camera):
+    """Randomly sample valid pixels of the camera, entirely on the camera's device.
 
-    # # Random subsampling of pixel coordinates
-    # rand_idx = torch.randperm(xy_grid.shape[0])
-    # xy_grid_sub = xy_grid[rand_idx[:n_pixels]].cuda()
-
-    # # Return
-    # return xy_grid_sub.reshape(-1, 2)[:n_pixels]
-    valid_mask = camera.get_valid_mask()
-
-    # Tensor of pixels coordinates (x, y), of shape (2, W, H). Shape: (2, W*H). This is where we can randomly choose pixels to create NeRF training batches.
-    pixel_coords = camera.pixel_coordinates(shift=0, normalized=False, flatten=False)
-    pixel_coords =  pixel_coords.to(dtype=torch.uint8)
+    The camera is a LinearSphereModel, which caches its valid pixels at construction. Pixels are drawn with replacement, such that sampling is O(n_pixels) instead of a permutation of all the valid pixels.
+    Returns the pixel coordinates (int32) and their normalized [-1, 1] counterparts, both of shape (2, n_pixels).
+    """
+    rand_idx = torch.randint(
+        0, camera.valid_pixel_coords.shape[1], (n_pixels,), device=camera.valid_pixel_coords.device
+    )
+    coords_sub = camera.valid_pixel_coords[:, rand_idx]
+    xy_grid_sub = camera.valid_xy_coords[:, rand_idx]
 
-    # Same but normalized to [-1, 1] range. Shape: (2, W*H)
-    xy_coords = camera.pixel_coordinates(shift=0, normalized=True, flatten=False)
+    # Return
+    return coords_sub, xy_grid_sub # Shapes are (2, n_pixels) and (2, n_pixels)
 
-    # Get valid pixels.
-    valid_pixel_coords = pixel_coords[:, valid_mask == 1]
-    valid_xy_coords = xy_coords[:, valid_mask == 1]
 
-    # Random subsampling of pixel coordinates.
-    rand_idx = torch.randperm(valid_pixel_coords.shape[1])
-    xy_grid_sub = valid_xy_coords[:, rand_idx[:n_pixels]].cuda()
-    coords_sub = valid_pixel_coords[:, rand_idx[:n_pixels]].cuda()
+# Rotate camera-frame rays into the world frame, and get their origins. Plain tensor math, such that it can be compiled into a single fused kernel.
+# x_cam_rays is (3, N), R_base_cam is (3, 3), R_world_base is (..., 3, 3) and t_world_base is (..., 3). Returns the origins and directions, both of shape (... * N, 3).
+@torch.compile(fullgraph=True, dynamic=False)
+def _rays_to_world(x_cam_rays, R_base_cam, R_world_base, t_world_base):
+    n_rays = x_cam_rays.shape[-1]
 
-    # Return
-    return coords_sub, xy_grid_sub # Shapes are (2, n_pixels) and (2, n_pixels)
+    # Rotate the rays from the camera frame, via the base frame, to the world frame.
+    R_world_cam = R_world_base @ R_base_cam
+    rays_d = x_cam_rays.T @ R_world_cam.transpose(-1, -2)
 
+    # All the rays of a pose start at its camera center.
+    rays_o = t_world_base.unsqueeze(-2).expand(*t_world_base.shape[:-1], n_rays, 3)
 
-    
+    # Flatten the poses into the rays.
+    return rays_o.reshape(-1, 3), rays_d.reshape(-1, 3)
 
 
 # Get rays from pixel values.
-def get_rays_from_pixels(pixel_coords, camera, X_ned_cam, camera_pose_ned, debug=False):
+def get_rays_from_pixels(pixel_coords, camera, X_ned_cam, camera_pose_ned, debug=False, debug_dir="."):
     """Get rays from pixel values.
 
     This function takes in pixel coordinates in range ([0, W], [0, H]), organized in the shape (2, N), where N is the number of pixels. It returns a RayBundle object, which contains the following attributes:
@@ -165,30 +165,28 @@ def get_rays_from_pixels(pixel_coords, camera, X_ned_cam, camera_pose_ned, debug
         - sample_points: (N, S, 3) tensor of sample points along the ray. The value here is zeros, as no samples are made yet.
         - sample_lengths: (N, S, 1) tensor of sample lengths along the ray. The value here is zeros, as no samples are made yet.
 
+    The camera pose may also be a batch of F poses, of shape (F, 7). The same pixels are then cast from every pose at once, and the rays are ordered pose-major, with N = F * number of pixels.
+
+    With debug set, plots of the rays in the camera, base and world frames are saved to debug_dir.
+
     """
 
     # Map pixels to 3D points on the unit sphere (otherwise known as unit vectors.) These are in the camera's coordinate system (z forward, x right, y down). The output is of shape (3, N), where N is the number of pixels.
     x_cam_rays, valid_mask = camera.pixel_2_ray(pixel_coords)
 
-    # Transform the rays from the camera's coordinate system to the base coordinate system, which is NED.
-    # Rays in the base frame NED.
-    X_ned_cam = X_ned_cam.to(x_cam_rays.device)
-    x_base_rays = X_ned_cam @ x_cam_rays.T
-    x_base_rays = x_base_rays.to(device=x_cam_rays.device)
-       
-    # Get ray origins from camera center.
-    rays_o = camera_pose_ned.translation()
-    rays_o = rays_o.repeat(x_base_rays.shape[0], 1)
+    # Transform the rays from the camera's coordinate system to the base coordinate system, which is NED, and then rotate them by the base rotation, which would yield their directions in the world frame (yes it is still NED).
+    # The camera and the base only differ by a rotation, so only the rotations are needed. The rotation is broadcast over the rays, and all the poses are applied in one call.
+    R_base_cam = X_ned_cam.rotation().matrix().to(x_cam_rays.device)
 
-    # Rotate the rays by the base rotation, which would yield their directions in the world frame (yes it is still NED). 
-    # First, convert the pose to a transformation matrix.
+    # Get ray origins from camera center.
     X_world_base = camera_pose_ned
-    R_world_base = X_world_base.rotation()
-    rays_d = R_world_base @ x_base_rays
+    R_world_base = X_world_base.rotation().matrix()
+    rays_o, rays_d = _rays_to_world(x_cam_rays, R_base_cam, R_world_base, X_world_base.translation())
 
     if debug:
         # Visualize the rays.   
         import matplotlib.pyplot as plt
+        x_cam_rays, rays_d = x_cam_rays.detach(), rays_d.detach()
         fig = plt.figure()
         ax = fig.add_subplot(111, projection='3d')
         ax.scatter(x_cam_rays.cpu()[0], x_cam_rays.cpu()[1], x_cam_rays.cpu()[2], c='r', marker='o')
@@ -201,6 +199,7 @@ def get_rays_from_pixels(pixel_coords, camera, X_ned_cam, camera_pose_ned, debug
         ax.quiver(0, 0, 0, 0, 0, 1, color='b', arrow_length_ratio=0.1, pivot='tail', linewidth=5)
         ax.title.set_text('Rays in the camera frame (Z forward, X right, Y down)')
         # Visualize the rays.   
+        x_base_rays = x_cam_rays.T @ R_base_cam.T
         fig2 = plt.figure()
         ax = fig2.add_subplot(111, projection='3d')
         ax.scatter(x_base_rays.cpu()[0], x_base_rays.cpu()[1], x_base_rays.cpu()[2], c='r', marker='o')
@@ -224,7 +223,9 @@ def get_rays_from_pixels(pixel_coords, camera, X_ned_cam, camera_pose_ned, debug
         ax.quiver(0, 0, 0, 0, 1, 0, color='g', arrow_length_ratio=0.1, pivot='tail', linewidth=5)
         ax.quiver(0, 0, 0, 0, 0, 1, color='b', arrow_length_ratio=0.1, pivot='tail', linewidth=5)
         ax.title.set_text('Rays in the world frame (NED). For illustration purposes only, the world origin coincides in translation with the base origin.')
-        plt.show()
+        for name, f in zip(["cam", "base", "world"], [fig, fig2, fig3]):
+            f.savefig(os.path.join(debug_dir, f"debug_rays_{name}.png"))
+            plt.close(f)
 
     # Create and return RayBundle
     return RayBundle(
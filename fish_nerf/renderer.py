@@ -1,5 +1,13 @@
 import torch
 
+from fish_nerf.ray import RayBundle
+
+# Optional dependency, only required by the nerfacc renderer.
+try:
+    import nerfacc
+except ImportError:
+    nerfacc = None
+
 
 # Volume renderer which integrates color and density along rays
 # according to the equations defined in [Mildenhall et al. 2020]
@@ -13,11 +21,13 @@ class VolumeRenderer(torch.nn.Module):
         )
 
     def _compute_weights(self, deltas, rays_density: torch.Tensor, eps: float = 1e-10):
-        # Compute transmittance using the equation described in the README
-        weights = torch.exp(-deltas * rays_density)
+        # Compute transmittance using the equation described in the README.
+        # Keep it in full precision, even under autocast, as the accumulated
+        # transmittance gets as small as ~1e-4 and reduced precision breaks it.
+        weights = torch.exp(-deltas.float() * rays_density.float())
 
         # Shift it all over by one
-        T = torch.cumprod(weights, dim=1)
+        T = torch.cumprod(weights, dim=1, dtype=torch.float32)
         T = torch.cat(
             (
                 torch.ones_like(T[:, :1]),
@@ -99,4 +109,138 @@ class VolumeRenderer(torch.nn.Module):
         return out
 
 
-renderer_dict = {"volume": VolumeRenderer}
+# Volume renderer which skips empty space with an occupancy grid, using nerfacc.
+# Sampling and alpha compositing are done by nerfacc's fused kernels, so the
+# sampler is only used for its near / far depths.
+class NerfaccVolumeRenderer(torch.nn.Module):
+    def __init__(self, cfg):
+        super().__init__()
+
+        if nerfacc is None:
+            raise ImportError("The 'nerfacc' renderer requires nerfacc (https://github.com/nerfstudio-project/nerfacc).")
+
+        self._chunk_size = cfg.chunk_size
+        self._white_background = (
+            cfg.white_background if "white_background" in cfg else False
+        )
+        self._render_step_size = (
+            cfg.render_step_size if "render_step_size" in cfg else 5e-3
+        )
+        self._occ_update_interval = (
+            cfg.occ_update_interval if "occ_update_interval" in cfg else 16
+        )
+        self._occ_threshold = cfg.occ_threshold if "occ_threshold" in cfg else 1e-2
+
+        # Occupancy grid over the scene bounds [x_min, y_min, z_min, x_max, y_max, z_max].
+        self.estimator = nerfacc.OccGridEstimator(
+            roi_aabb=torch.tensor(list(cfg.aabb), dtype=torch.float32),
+            resolution=cfg.occ_resolution if "occ_resolution" in cfg else 128,
+        )
+
+        # Training step counter for the occupancy grid updates. A host side int (a device buffer would sync on every step), checkpointed as extra state such that resumed runs do not repeat the grid warmup.
+        self._step = 0
+
+    def get_extra_state(self):
+        return {"step": self._step}
+
+    def set_extra_state(self, state):
+        self._step = int(state["step"])
+
+    def _query(self, implicit_fn, points, directions):
+        # Implicit functions take ray bundles, so wrap each sample as a ray with a single point.
+        ray_bundle = RayBundle(
+            points,
+            directions,
+            points.unsqueeze(1),
+            torch.zeros_like(points[..., :1]).unsqueeze(1),
+        )
+        return implicit_fn(ray_bundle)
+
+    def _update_occupancy(self, implicit_fn):
+        def occ_eval_fn(x):
+            density = self._query(implicit_fn, x, torch.zeros_like(x))["density"]
+            return density.squeeze(-1) * self._render_step_size
+
+        self.estimator.update_every_n_steps(
+            step=self._step,
+            occ_eval_fn=occ_eval_fn,
+            occ_thre=self._occ_threshold,
+            n=self._occ_update_interval,
+        )
+        self._step += 1
+
+    def forward(
+        self,
+        sampler,
+        implicit_fn,
+        ray_bundle,
+    ):
+        B = ray_bundle.shape[0]
+
+        # Only update the occupancy grid on actual training steps (not on renders during training).
+        if self.training and torch.is_grad_enabled():
+            self._update_occupancy(implicit_fn)
+
+        render_bkgd = (
+            torch.ones(3, device=ray_bundle.origins.device)
+            if self._white_background
+            else None
+        )
+
+        # Process the chunks of rays.
+        chunk_outputs = []
+
+        for chunk_start in range(0, B, self._chunk_size):
+            origins = ray_bundle.origins[chunk_start : chunk_start + self._chunk_size]
+            directions = ray_bundle.directions[chunk_start : chunk_start + self._chunk_size]
+
+            def sigma_fn(t_starts, t_ends, ray_indices):
+                t_dirs = directions[ray_indices]
+                points = origins[ray_indices] + t_dirs * ((t_starts + t_ends) / 2.0)[:, None]
+                return self._query(implicit_fn, points, t_dirs)["density"].squeeze(-1)
+
+            def rgb_sigma_fn(t_starts, t_ends, ray_indices):
+                t_dirs = directions[ray_indices]
+                points = origins[ray_indices] + t_dirs * ((t_starts + t_ends) / 2.0)[:, None]
+                implicit_output = self._query(implicit_fn, points, t_dirs)
+                return implicit_output["feature"], implicit_output["density"].squeeze(-1)
+
+            # Sample points along the rays, skipping the empty space
+            ray_indices, t_starts, t_ends = self.estimator.sampling(
+                origins,
+                directions,
+                sigma_fn=sigma_fn,
+                near_plane=sampler.min_depth,
+                far_plane=sampler.max_depth,
+                render_step_size=self._render_step_size,
+                stratified=self.training,
+            )
+
+            # Composite colors and depths
+            feature, _, depth, _ = nerfacc.rendering(
+                t_starts,
+                t_ends,
+                ray_indices,
+                n_rays=origins.shape[0],
+                rgb_sigma_fn=rgb_sigma_fn,
+                render_bkgd=render_bkgd,
+            )
+
+            # Return
+            cur_out = {
+                "feature": feature,
+                "depth": depth,
+            }
+
+            chunk_outputs.append(cur_out)
+
+        # Concatenate chunk outputs
+        out = {
+            k: torch.cat([chunk_out[k] for chunk_out in chunk_outputs], dim=0)
+            for k in chunk_outputs[0].keys()
+        }
+
+        return out
+
+
+renderer_dict = {"volume": VolumeRenderer, "nerfacc": NerfaccVolumeRenderer}
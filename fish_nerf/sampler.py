@@ -14,15 +14,18 @@ class StratifiedRaysampler(torch.nn.Module):
         self,
         ray_bundle,
     ):
+        ray_bundle.origins = ray_bundle.origins.cuda()
+        ray_bundle.directions = ray_bundle.directions.cuda()
+
         # Compute z values for self.n_pts_per_ray points
-        # uniformly sampled between [near, far]
+        # uniformly sampled between [near, far]. They are created on the GPU
+        # directly, as a host to device copy would break CUDA graph capture.
         z_vals = torch.linspace(
-            self.min_depth, self.max_depth, self.n_pts_per_ray
-        ).cuda()[:, None, None]
+            self.min_depth, self.max_depth, self.n_pts_per_ray,
+            device=ray_bundle.origins.device,
+        )[:, None, None]
 
         # Sample points from z values
-        ray_bundle.origins = ray_bundle.origins.cuda()
-        ray_bundle.directions = ray_bundle.directions.cuda()
         sample_points = ray_bundle.origins + ray_bundle.directions * z_vals
         sample_points = sample_points.transpose(0, 1).contiguous()
 
@@ -1,6 +1,7 @@
 # General imports.
 import os
-import random
+import pickle
+import multiprocessing
 import hydra
 import imageio
 import numpy as np
@@ -9,21 +10,30 @@ import tqdm
 from omegaconf import DictConfig
 import matplotlib.pyplot as plt
 from  datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 
 import pypose as pp
-from fish_nerf.models import volume_dict, LinearSphereModel, PoseModel
+from fish_nerf.models import volume_dict, cast_linear_weights, LinearSphereModel, PoseModel
 from fish_nerf.ray import (
+    RayBundle,
     get_random_pixels_from_image,
     get_rays_from_pixels,
     sample_images_at_xy,
 )
 from fish_nerf.renderer import renderer_dict
 from fish_nerf.sampler import sampler_dict
-from utils.dataset import get_dataset, trivial_collate
+from utils.dataset import TartanAirSample, get_dataset, trivial_collate
 from utils.render import render_images, render_images_in_poses
 
 np.set_printoptions(suppress=True, precision=3, linewidth=100)
 
+# Autocast dtypes for the model forward pass. None runs in full precision.
+precision_dict = {
+    "fp32": None,
+    "bf16": torch.bfloat16,
+    "fp16": torch.float16,
+}
+
 
 # Model class containing:
 #   1) Implicit volume defining the scene
@@ -35,11 +45,15 @@ class Model(torch.nn.Module):
     def __init__(self, cfg):
         super().__init__()
 
-        # Some geometry that we need for conversions.
-        self.X_ned_cam = pp.from_matrix(torch.tensor([[0, 0, 1, 0],
-                                                    [1, 0, 0, 0],
-                                                    [0, 1, 0, 0],
-                                                    [0, 0, 0, 1]]).view(4, 4).float(), pp.SE3_type)
+        # Some geometry that we need for conversions. Registered as a buffer, such that it moves with the model.
+        self.register_buffer(
+            "X_ned_cam",
+            pp.from_matrix(torch.tensor([[0, 0, 1, 0],
+                                         [1, 0, 0, 0],
+                                         [0, 1, 0, 0],
+                                         [0, 0, 0, 1]]).view(4, 4).float(), pp.SE3_type),
+            persistent=False,
+        )
 
         # Get implicit function from config
         self.implicit_fn = volume_dict[cfg.implicit_function.type](
@@ -52,12 +66,58 @@ class Model(torch.nn.Module):
         # Initialize volume renderer
         self.renderer = renderer_dict[cfg.renderer.type](cfg.renderer)
 
+        # Mixed precision for the implicit function (the renderer keeps the transmittance in full precision).
+        self.amp_dtype = precision_dict[cfg.training.precision]
+        # The autocast weight cache is not compatible with CUDA graph capture, so it is only disabled when graphing.
+        self.amp_cache_enabled = not cfg.training.cuda_graphs
+
     def forward(self, ray_bundle):
         # Call renderer with
         #  a) Implicit volume
         #  b) Sampling routine
+        with torch.autocast(device_type="cuda", dtype=self.amp_dtype, enabled=self.amp_dtype is not None, cache_enabled=self.amp_cache_enabled):
+            out = self.renderer(self.sampler, self.implicit_fn, ray_bundle)
+
+        # Outputs are always returned in full precision (e.g. numpy has no bfloat16).
+        return {k: v.float() for k, v in out.items()}
+
+
+# Tensor only wrapper around the model, as torch.cuda.make_graphed_callables
+# only takes tensors as inputs and outputs. Returns the rendered features.
+class RenderRaysFn(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+
+        self.model = model
+
+    def forward(self, origins, directions):
+        ray_bundle = RayBundle(
+            origins,
+            directions,
+            torch.zeros_like(origins).unsqueeze(1),
+            torch.zeros_like(origins).unsqueeze(1),
+        )
 
-        return self.renderer(self.sampler, self.implicit_fn, ray_bundle)
+        return self.model(ray_bundle)["feature"]
+
+
+def load_checkpoint(checkpoint_path):
+    # Memory map the checkpoint and only unpickle tensors and containers, which is faster (and safer) than a full unpickling.
+    try:
+        return torch.load(checkpoint_path, map_location="cuda", mmap=True, weights_only=True)
+    except pickle.UnpicklingError:
+        # Older checkpoints store pypose LieTensors, which need the full unpickler. It is requested explicitly, as weights_only defaults to True from PyTorch 2.6.
+        return torch.load(checkpoint_path, map_location="cuda", weights_only=False)
+
+
+def create_render_model(cfg, model):
+    # Inference only copy of the model, with the implicit function weights stored in the autocast precision.
+    render_model = Model(cfg).cuda()
+    render_model.load_state_dict(model.state_dict())
+    render_model.eval()
+    if render_model.amp_dtype is not None:
+        cast_linear_weights(render_model.implicit_fn, render_model.amp_dtype)
+    return render_model
 
 
 def create_model(cfg, poses_est=None):
@@ -90,7 +150,7 @@ def create_model(cfg, poses_est=None):
         # Resume training if requested.
         if cfg.training.resume and os.path.isfile(checkpoint_path):
             print(f"Resuming from checkpoint {checkpoint_path}.")
-            loaded_data = torch.load(checkpoint_path)
+            loaded_data = load_checkpoint(checkpoint_path)
 
             model.load_state_dict(loaded_data["model"])
             camera.load_state_dict(loaded_data["camera"])
@@ -128,26 +188,61 @@ def create_model(cfg, poses_est=None):
     return model, camera, pose_model, optimizer, lr_scheduler, start_epoch, checkpoint_path
 
 
+def to_plain_tensors(data):
+    """
+    Recursively replace the pypose LieTensors of (nested) state dicts with their underlying tensors, such that they can be loaded with torch.load(weights_only=True).
+    """
+    if isinstance(data, pp.LieTensor):
+        return data.tensor()
+    if isinstance(data, dict):
+        return {key: to_plain_tensors(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return type(data)(to_plain_tensors(value) for value in data)
+    return data
+
+
+def records_to_numpy(records):
+    """
+    Convert a list of (iteration, scalar tensor) records to an (N, 2) numpy array, copying all the values to the CPU at once.
+    """
+    iterations = np.array([iteration for iteration, _ in records])
+    values = torch.stack([value for _, value in records]).float().cpu().numpy()
+    return np.stack((iterations, values), axis=-1)
+
+
 def train(cfg):
     torch.manual_seed(cfg.seed)
 
-    # Image shape and size. Be convention,
-    # the image shape is [H, W] and the image size is [W, H].
-    image_size = [cfg.data.image_shape[1], cfg.data.image_shape[0]]
-
     # Load the training/validation data.
     train_dataset, val_dataset = get_dataset(
         traj_data_root=cfg.data.traj_data_root,
         image_shape=[cfg.data.image_shape[1], cfg.data.image_shape[0]],
     )
 
-    train_dataloader = torch.utils.data.DataLoader(
-        train_dataset,
-        batch_size=1,  # One image at a time, and the batches are of ray samples.
-        shuffle=True,
-        num_workers=0,
-        collate_fn=trivial_collate,
-    )
+    # Small datasets are loaded to the GPU once, and then shuffled there every epoch. No data is copied to the GPU while training. Datasets above the memory budget (images are not resized, so this is at native resolution) are streamed by a DataLoader from pinned memory.
+    cache_on_gpu = False
+    if cfg.data.cache_on_gpu:
+        cache_size_mb = len(train_dataset) * train_dataset[0].image.numel() * 4 / 2**20
+        cache_on_gpu = cache_size_mb <= cfg.data.gpu_cache_budget_mb
+        if not cache_on_gpu:
+            print(f"Dataset needs {cache_size_mb:.0f} MB, more than the GPU cache budget of {cfg.data.gpu_cache_budget_mb} MB. Streaming it instead.")
+
+    if cache_on_gpu:
+        samples = [train_dataset[i] for i in range(len(train_dataset))]
+        all_images = torch.cat([sample.image for sample in samples]).cuda() # (N, 3, H, W)
+        all_poses = torch.stack([sample.pose for sample in samples]).cuda() # (N, 7)
+        del samples
+    else:
+        train_dataloader = torch.utils.data.DataLoader(
+            train_dataset,
+            batch_size=1,  # One image at a time, and the batches are of ray samples.
+            shuffle=True,
+            num_workers=cfg.training.num_workers,
+            collate_fn=trivial_collate,
+            pin_memory=True,
+            persistent_workers=cfg.training.num_workers > 0,
+            prefetch_factor=4 if cfg.training.num_workers > 0 else None,
+        )
 
     # Create model
     var_t = cfg.data.var_t if cfg.training.train_t else 0
@@ -163,138 +258,205 @@ def train(cfg):
     results_dir = os.path.join(results_root_dir, experiment_name)
     os.makedirs(results_dir, exist_ok=False)
 
-    # Keep track of the camera poses (NED) seen so far (to sample from for validation).
-    seen_camera_poses = set()
+    # The model forward and backward passes are captured in a CUDA graph after a few warmup iterations, if requested. This needs fixed shapes, so only the volume renderer (with its fixed number of samples per ray) is supported.
+    if cfg.training.cuda_graphs and cfg.renderer.type != "volume":
+        raise ValueError(f"CUDA graphs are not supported with the {cfg.renderer.type} renderer.")
+    cuda_graph_warmup_iters = 10
+    graphed_render_fn = None
+    n_train_steps = 0
+
+    # Loss scaling is only needed for fp16, bf16 has the same range as fp32.
+    scaler = torch.amp.GradScaler("cuda", enabled=cfg.training.precision == "fp16")
+
+    # Keep track of the camera poses (NED) seen so far (to sample from for validation). A flag per frame, preallocated on the CPU, so memory is bounded and marking a pose never syncs with the GPU.
+    seen_camera_poses = torch.zeros(train_dataset.num_frames, dtype=torch.bool)
 
-    # Keep track of losses and estimated parameters. All lists are of tuples (iteration, value).
+    # Keep track of losses and estimated parameters. A list of arrays per epoch, all of rows (iteration, value), which are only concatenated when stored.
     photometric_loss = []
     fov_est = []
 
-    # Run the main training loop.
-    for epoch in range(start_epoch, cfg.training.num_epochs):
-        t_range = tqdm.tqdm(enumerate(train_dataloader), total=len(train_dataloader))
-
-        pose_est = pose_model()
-        pose_error = (train_dataset.poses_gt.Inv()@pose_est).Log().norm() # torch.linalg.inv(pose_gt)@pose
-
-        for iteration, batch in t_range:
-            idx, image, pose_gt = batch[0] # Batches are not collated, so `batch` is a list of samples. Take the first one only. NOTE(yoraish): This means that a batch size larger than 1 passed to the torch.utils.data.DataLoader will be a waste of work, and the first sample in the batch will be used (and incorreectly so, since we'll try to index into the tensor and things will probably break).
-            pose = pose_model(idx)
-            seen_camera_poses.add(idx)
-
-            # Sample rays. The xy grid is of shape (2, N), where N is the number of rays. The first row is the x (column) coordinates, and the second row is the y (row) coordinates. By convention, the image origin is top left, and the x axis is to the right, and the y axis is down.
-            pixel_coords, pixel_xys = get_random_pixels_from_image(
-                cfg.training.batch_size, image_size, camera.model
-            )
-
-            if cfg.debug:
-                # Show the valid mask.
-                image_np = camera.model.get_valid_mask().cpu().numpy()
-                plt.imshow(image_np)
-                plt.show()
-
-                # Show the sampled pixels.
-                image_np = image.squeeze(0).cpu().numpy().transpose(1, 2, 0) * 0
-                image_np[pixel_coords.cpu()[1, :], pixel_coords.cpu()[0, :]] = 1
-                plt.imshow(image_np)
-                plt.show()
-
-            # A ray bundle is a collection of rays. RayBundle Object includes origins, directions, sample_points, sample_lengths. Origins are tensor (N, 3) in NED world frame, directions are tensor (N, 3) of unit vectors our of the camera origin defined in its own NED origin, sample_points are tensor (N, S, 3), sample_lengths are tensor (N, S - 1) of the lengths of the segments between sample_points.
-            ray_bundle = get_rays_from_pixels(pixel_coords, camera.model, model.X_ned_cam, pose, debug=cfg.debug)
+    # GIFs are encoded in a persistent background process, such that training does not wait for them. The worker is spawned rather than forked, as forking a multithreaded CUDA process is unsafe.
+    gif_writer = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    gif_future = None
+
+    try:
+        # Run the main training loop.
+        for epoch in range(start_epoch, cfg.training.num_epochs):
+            if cache_on_gpu:
+                # Same batches as the DataLoader would make: a list with a single, shuffled sample.
+                train_batches = (
+                    [TartanAirSample(idx, all_images[idx : idx + 1], all_poses[idx])]
+                    for idx in torch.randperm(len(train_dataset)).tolist()
+                )
+            else:
+                train_batches = train_dataloader
+            t_range = tqdm.tqdm(enumerate(train_batches), total=len(train_dataset))
+
+            pose_est = pose_model()
+            pose_error = (train_dataset.poses_gt.Inv()@pose_est).Log().norm() # torch.linalg.inv(pose_gt)@pose
+
+            # Records of this epoch, as tuples (iteration, value). The values stay on the GPU until the end of the epoch, such that recording them does not sync every iteration.
+            epoch_photometric_loss = []
+            epoch_fov_est = []
+
+            for iteration, batch in t_range:
+                idx, image, pose_gt = batch[0] # Batches are not collated, so `batch` is a list of samples. Take the first one only. NOTE(yoraish): This means that a batch size larger than 1 passed to the torch.utils.data.DataLoader will be a waste of work, and the first sample in the batch will be used (and incorreectly so, since we'll try to index into the tensor and things will probably break).
+                image = image.cuda(non_blocking=True) # The image comes from pinned memory, so this copy overlaps with the work already queued on the GPU. A no-op for images cached on the GPU.
+                pose = pose_model(idx)
+                seen_camera_poses[idx] = True
+
+                # Sample rays. The xy grid is of shape (2, N), where N is the number of rays. The first row is the x (column) coordinates, and the second row is the y (row) coordinates. By convention, the image origin is top left, and the x axis is to the right, and the y axis is down.
+                pixel_coords, pixel_xys = get_random_pixels_from_image(
+                    cfg.training.batch_size, camera
+                )
+
+                # Debug visualizations are only made on the first training step, as they sync with the GPU (and the ray plots block).
+                debug = cfg.debug and epoch == start_epoch and iteration == 0
+
+                if debug:
+                    # Save the valid mask.
+                    image_np = camera.valid_mask.float().cpu().numpy()
+                    plt.imsave(os.path.join(results_dir, "debug_valid_mask.png"), image_np)
+
+                    # Save the sampled pixels.
+                    image_np = image.squeeze(0).cpu().numpy().transpose(1, 2, 0) * 0
+                    image_np[pixel_coords.cpu()[1, :], pixel_coords.cpu()[0, :]] = 1
+                    plt.imsave(os.path.join(results_dir, "debug_sampled_pixels.png"), image_np)
+
+                # A ray bundle is a collection of rays. RayBundle Object includes origins, directions, sample_points, sample_lengths. Origins are tensor (N, 3) in NED world frame, directions are tensor (N, 3) of unit vectors our of the camera origin defined in its own NED origin, sample_points are tensor (N, S, 3), sample_lengths are tensor (N, S - 1) of the lengths of the segments between sample_points.
+                # The camera itself maps the pixels to rays, from its lookup table when the intrinsics are fixed.
+                ray_bundle = get_rays_from_pixels(pixel_coords, camera, model.X_ned_cam, pose, debug=debug, debug_dir=results_dir)
           
-            # Sample the image at the sampled pixels. rgb_gt is of shape (N, 3), where N is the number of rays.
-            rgb_gt = image[:, :, pixel_coords[1, :].long(), pixel_coords[0, :].long()].squeeze(0).transpose(0, 1)
-
-            # Run model forward
-            out = model(ray_bundle)
-
-            # Calculate loss
-            loss = torch.nn.functional.mse_loss(out["feature"], rgb_gt)
-
-            # Take the training step.
-            optimizer.zero_grad()
-            loss.backward()
-            optimizer.step()
-
-            # Record the loss and estimated parameters.
-            iteration_abs_num = epoch * len(train_dataloader) + iteration
-            photometric_loss.append((iteration_abs_num, loss.cpu().item()))
-            fov_est.append((iteration_abs_num, camera.forward().cpu().item()))
-
-            # Update the progress bar.
-            t_range.set_description(f"Epoch: {epoch:04d}, Loss: {loss:.06f}, FOV: {camera.forward():.03f}, Pose: {pose_error:.04f}")
-            t_range.refresh()
-
-        # Adjust the learning rate.
-        lr_scheduler.step()
-
-        pose_model.apply_delta()
-
-        # Checkpoint.
-        if (
-            epoch % cfg.training.checkpoint_interval == 0
-            and len(cfg.training.checkpoint_path) > 0
-            and epoch > 0
-        ):
-            print(f"Storing checkpoint {checkpoint_path}.")
-
-            data_to_store = {
-                "model": model.state_dict(),
-                "camera": camera.state_dict(),
-                "pose": pose_model.state_dict(),
-                "optimizer": optimizer.state_dict(),
-                "epoch": epoch,
-            }
-
-            torch.save(data_to_store, checkpoint_path)
-
-            # Save the photometric loss and estimated fov.
-            print(f"Storing photometric loss and estimated fov to {results_dir}.")
-            photometric_save_path = os.path.join(results_dir, "photometric_loss.npy")
-            fov_save_path = os.path.join(results_dir, "fov_est.npy")
-            np.save(photometric_save_path, np.array(photometric_loss))
-            np.save(fov_save_path, np.array(fov_est))
-
-
-        # Render
-        if epoch % cfg.training.render_interval == 0 and epoch > 0:
-            with torch.no_grad():
-                # We can rednder images in a given pose, outputting a list of images showing the camera rotating around its own axis.
-                # Choose a random camera pose.
-                if cfg.vis_style == "random_pose":
-                    idx = random.sample(seen_camera_poses, 1)[0]
-                    random_pose = pose_model(idx)
-                    print(f"Rendering at pose {random_pose}.")
-                    test_images = render_images(
-                        model,
-                        camera,
-                        translation = random_pose[:3, 3],
-                        num_images=20,
+                # Sample the image at the sampled pixels. rgb_gt is of shape (N, 3), where N is the number of rays.
+                # Gather with a linear pixel index from the channel first (3, H * W) view of the image, which needs no copy of the image.
+                W = image.shape[-1]
+                lin_idx = pixel_coords[1].to(torch.int64) * W + pixel_coords[0].to(torch.int64)
+                rgb_gt = image[0].flatten(1).index_select(1, lin_idx).T
+
+                # Capture the model once the warmup is done. The inputs only serve as examples of shapes, dtypes and required gradients. Gradients to the poses and intrinsics still flow through the graphed model's inputs.
+                if cfg.training.cuda_graphs and graphed_render_fn is None and n_train_steps >= cuda_graph_warmup_iters:
+                    sample_args = tuple(
+                        x.detach().clone().requires_grad_(x.requires_grad)
+                        for x in (ray_bundle.origins, ray_bundle.directions)
                     )
+                    graphed_render_fn = torch.cuda.make_graphed_callables(RenderRaysFn(model), sample_args)
+
+                # Run model forward
+                if graphed_render_fn is not None:
+                    out = {"feature": graphed_render_fn(ray_bundle.origins, ray_bundle.directions)}
+                else:
+                    out = model(ray_bundle)
+
+                # Calculate loss
+                loss = torch.nn.functional.mse_loss(out["feature"], rgb_gt)
+
+                # Take the training step.
+                optimizer.zero_grad()
+                scaler.scale(loss).backward()
+                scaler.step(optimizer)
+                scaler.update()
+                n_train_steps += 1
+
+                # Record the loss and estimated parameters.
+                iteration_abs_num = epoch * len(train_dataset) + iteration
+                epoch_photometric_loss.append((iteration_abs_num, loss.detach()))
+                fov = camera.forward().detach()
+                epoch_fov_est.append((iteration_abs_num, fov))
+
+                # Update the progress bar (printing the values syncs with the GPU, so not every iteration).
+                if iteration % cfg.training.log_interval == 0:
+                    t_range.set_description(f"Epoch: {epoch:04d}, Loss: {loss:.06f}, FOV: {fov:.03f}, Pose: {pose_error:.04f}")
+                    t_range.refresh()
+
+            # Copy the records of this epoch to the CPU.
+            photometric_loss.append(records_to_numpy(epoch_photometric_loss))
+            fov_est.append(records_to_numpy(epoch_fov_est))
+
+            # Adjust the learning rate.
+            lr_scheduler.step()
+
+            pose_model.apply_delta()
+
+            # Checkpoint.
+            if (
+                epoch % cfg.training.checkpoint_interval == 0
+                and len(cfg.training.checkpoint_path) > 0
+                and epoch > 0
+            ):
+                print(f"Storing checkpoint {checkpoint_path}.")
+
+                data_to_store = {
+                    "model": model.state_dict(),
+                    "camera": camera.state_dict(),
+                    "pose": pose_model.state_dict(),
+                    "optimizer": optimizer.state_dict(),
+                    "epoch": epoch,
+                }
+
+                torch.save(to_plain_tensors(data_to_store), checkpoint_path)
+
+                # Save the photometric loss and estimated fov.
+                print(f"Storing photometric loss and estimated fov to {results_dir}.")
+                photometric_save_path = os.path.join(results_dir, "photometric_loss.npy")
+                fov_save_path = os.path.join(results_dir, "fov_est.npy")
+                np.save(photometric_save_path, np.concatenate(photometric_loss))
+                np.save(fov_save_path, np.concatenate(fov_est))
+
+
+            # Render
+            if epoch % cfg.training.render_interval == 0 and epoch > 0:
+                render_model = create_render_model(cfg, model)
+                with torch.inference_mode():
+                    # We can rednder images in a given pose, outputting a list of images showing the camera rotating around its own axis.
+                    # Choose a random camera pose.
+                    if cfg.vis_style == "random_pose":
+                        seen_idx = seen_camera_poses.nonzero().squeeze(-1)
+                        idx = seen_idx[torch.randint(0, seen_idx.shape[0], (1,))].item()
+                        random_pose = pose_model(idx)
+                        print(f"Rendering at pose {random_pose}.")
+                        test_images = render_images(
+                            render_model,
+                            camera,
+                            translation = random_pose.translation().cpu().numpy(),
+                            num_images=20,
+                        )
                 
-                # We can also use a torch dataset to render images. The poses from the dataset are used as input to the model and the output is rendered, concaternated with the ground truth image, and returned. Note that we can also optionally fix the heading of the camera to xyzw = 0001.
-                if cfg.vis_style == "trajectory":
-                    print("Rendering Trajectory")
-                    test_images, fig = render_images_in_poses(
-                        model,
-                        camera,
-                        pose_model,
-                        train_dataset,
-
-                        num_images=cfg.training.render_num_images,
-                        fix_heading = True
+                    # We can also use a torch dataset to render images. The poses from the dataset are used as input to the model and the output is rendered, concaternated with the ground truth image, and returned. Note that we can also optionally fix the heading of the camera to xyzw = 0001.
+                    if cfg.vis_style == "trajectory":
+                        print("Rendering Trajectory")
+                        test_images, fig = render_images_in_poses(
+                            render_model,
+                            camera,
+                            pose_model,
+                            train_dataset,
+
+                            num_images=cfg.training.render_num_images,
+                            fix_heading = True
+                        )
+                        fig_out_path = os.path.join(results_dir, f"training_{epoch}_traj.png")
+                        fig.savefig(fig_out_path)
+                        fig.clf()
+
+                    # Surface any error of the previous GIF before writing the next one.
+                    if gif_future is not None:
+                        gif_future.result()
+
+                    frames = np.clip(np.stack(test_images) * 255, 0, 255).astype(np.uint8)
+                    gif_future = gif_writer.submit(
+                        imageio.mimsave,
+                        f"results/training_{epoch}.gif",
+                        frames,
                     )
-                    fig_out_path = os.path.join(results_dir, f"training_{epoch}_traj.png")
-                    fig.savefig(fig_out_path)
-                    fig.clf()
 
-                imageio.mimsave(
-                    f"results/training_{epoch}.gif",
-                    [np.uint8(im * 255) for im in test_images],
-                )
+        # Wait for the last GIF to be written.
+        if gif_future is not None:
+            gif_future.result()
+    finally:
+        # Do not leave the GIF worker behind, even if training fails.
+        gif_writer.shutdown(wait=True)
 
 
-# TODO: Clean this up so we can render w/o training
+# Render a spin around a trained camera position, without training.
 def render(
     cfg,
 ):
@@ -303,16 +465,43 @@ def render(
     model = model.cuda()
     model.eval()
 
-#     # Render spiral
-    # cameras = create_surround_cameras(3.0, n_poses=20)
-    # all_images = render_images(model, cameras, cfg.data.image_shape)
-    # imageio.mimsave("results/3d_revolve.gif", [np.uint8(im * 255) for im in all_images])
+    camera = LinearSphereModel(cfg.data.fov_degree, req_grad=False)
+    camera = camera.cuda()
+    camera.eval()
+
+    # Load the trained model and camera.
+    checkpoint_path = os.path.join(
+        hydra.utils.get_original_cwd(), cfg.training.checkpoint_path
+    )
+    if not os.path.isfile(checkpoint_path):
+        raise FileNotFoundError(f"No checkpoint to render from at {checkpoint_path}.")
+
+    print(f"Rendering from checkpoint {checkpoint_path}.")
+    loaded_data = load_checkpoint(checkpoint_path)
+    model.load_state_dict(loaded_data["model"])
+    camera.load_state_dict(loaded_data["camera"])
+
+    # Rendering only, so the trained weights can be stored in the autocast precision.
+    if model.amp_dtype is not None:
+        cast_linear_weights(model.implicit_fn, model.amp_dtype)
+
+    # Render spiral around the first camera position of the trajectory. No autograd bookkeeping is needed.
+    translation = loaded_data["pose"]["init_c2w"][0, :3].cpu().numpy()
+    with torch.inference_mode():
+        all_images = render_images(model, camera, translation=translation, num_images=20)
+
+    os.makedirs("results", exist_ok=True)
+    imageio.mimsave("results/3d_revolve.gif", np.clip(np.stack(all_images) * 255, 0, 255).astype(np.uint8))
 
 
 @hydra.main(config_path="./configs", config_name="main", version_base=None)
 def main(cfg: DictConfig):
     os.chdir(hydra.utils.get_original_cwd())
 
+    # Let cuDNN pick (and cache) the fastest algorithms, and allow TF32 for the float32 matmuls.
+    torch.backends.cudnn.benchmark = True
+    torch.set_float32_matmul_precision("high")
+
     if cfg.type == "render":
         render(cfg)
     elif cfg.type == "train":
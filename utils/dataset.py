@@ -1,6 +1,7 @@
 # General imports.
 import os
 import sys
+from dataclasses import dataclass
 import numpy as np
 import torch
 from torchvision import io
@@ -9,6 +10,26 @@ from colorama import Fore, Style
 from scipy.spatial.transform import Rotation
 import pypose as pp
 
+@dataclass
+class TartanAirSample:
+    '''
+    A single (uncollated) sample of the TartanAir dataset. The image and pose are kept on the CPU, such that the DataLoader can pin them and the training loop can copy them to the GPU with non_blocking=True.
+    '''
+    idx: int
+    image: torch.Tensor # (1, 3, H, W)
+    pose: torch.Tensor # (7,) as [x, y, z, qx, qy, qz, qw]
+
+    def __iter__(self):
+        # Allow unpacking as `idx, image, pose = sample`.
+        return iter((self.idx, self.image, self.pose))
+
+    def pin_memory(self):
+        # The DataLoader only pins the custom batch types that define this method.
+        self.image = self.image.pin_memory()
+        self.pose = torch.as_tensor(self.pose).pin_memory()
+        return self
+
+
 '''
 A Torch dataset for TartanAir-style data. It is a very simple implementation that can load only one trajectory at a time.
 '''
@@ -33,6 +54,9 @@ class TartanAirDataset(torch.utils.data.Dataset):
         poses_np = np.loadtxt(os.path.join(traj_data_root, 'pose_lcam_fish.txt'))
         self.poses_gt = pp.SE3(poses_np).to(device)
 
+        # A CPU copy of the poses, such that DataLoader workers never have to touch CUDA memory.
+        self.poses_gt_cpu = torch.from_numpy(poses_np).float()
+
 
     def __len__(self):
         return self.num_frames
@@ -50,9 +74,10 @@ class TartanAirDataset(torch.utils.data.Dataset):
 
 
         # Get the pose.
-        pose_gt = self.poses_gt[idx]
+        pose_gt = self.poses_gt_cpu[idx]
 
-        return idx, img.to(self.device), pose_gt
+        # Everything is returned on the CPU. Moving to self.device is left to the consumer, ideally from pinned memory.
+        return TartanAirSample(idx, img, pose_gt)
 
 def get_dataset(traj_data_root, image_shape):
     '''
@@ -21,35 +21,37 @@ def render_images(model, camera, translation, num_images):
     Render a list of images from the given viewpoints.
 
     """
-    all_images = []
     device = list(model.parameters())[0].device
     camera_model = camera.model
 
+    # The pixels are the same for every view, so only get them once.
+    pixel_coords, pixel_xys = get_pixels_from_image(
+        camera_model, filter_valid=True
+    )
 
     # Rotate around the origin of the camera. Aka, assign rotations to the input translation.
-    for theta_ix, theta in enumerate(np.linspace(0, 2 * np.pi, num_images + 1)[:-1]):
-        quat = Rotation.from_euler('z', theta, degrees=False).as_quat()
-        pose = np.array([*translation, *quat])
+    # The headings are in radians, and all their quaternions are computed in one call. Shape (num_images, 4).
+    thetas = np.linspace(0, 2 * np.pi, num_images + 1)[:-1]
+    quats = Rotation.from_euler('z', thetas, degrees=False).as_quat()
 
-        pixel_coords, pixel_xys = get_pixels_from_image(
-            camera_model, filter_valid=True
-        )
+    # All the views share the translation, so the poses are stacked from the tiled translation and the quaternions. Shape (num_images, 7).
+    translations = np.tile(np.asarray(translation), (num_images, 1))
+    poses = np.concatenate((translations, quats), axis=-1)
+    poses = pp.SE3(torch.tensor(poses, dtype=torch.float32, device=device))
 
-        # A ray bundle is a collection of rays. RayBundle Object includes origins, directions, sample_points, sample_lengths. Origins are tensor (N, 3) in NED world frame, directions are tensor (N, 3) of unit vectors our of the camera origin defined in its own NED origin, sample_points are tensor (N, S, 3), sample_lengths are tensor (N, S - 1) of the lengths of the segments between sample_points.
-        ray_bundle = get_rays_from_pixels(pixel_coords, camera_model, model.X_ned_cam, pose, debug=False)
-        
-        ray_bundle.origins = ray_bundle.origins.to(dtype=torch.float32)
-        ray_bundle.directions = ray_bundle.directions.to(dtype=torch.float32)
+    # A ray bundle is a collection of rays. RayBundle Object includes origins, directions, sample_points, sample_lengths. Origins are tensor (N, 3) in NED world frame, directions are tensor (N, 3) of unit vectors our of the camera origin defined in its own NED origin, sample_points are tensor (N, S, 3), sample_lengths are tensor (N, S - 1) of the lengths of the segments between sample_points.
+    # The rays of all the views are cast in a single call, such that the model also only runs once. Shapes are (num_images * N, 3).
+    ray_bundle = get_rays_from_pixels(pixel_coords, camera, model.X_ned_cam, poses, debug=False)
 
-        # Run model forward
-        out = model(ray_bundle)
+    # Run model forward
+    out = model(ray_bundle)
 
-        # Return rendered features (colors)
-        image = np.zeros((camera_model.ss.W, camera_model.ss.H, 3))
-        image[camera_model.get_valid_mask() == 1, :] = out["feature"].cpu().detach().numpy()
-        all_images.append(image)
+    # Return rendered features (colors). The views are scattered into their images on the GPU, and copied to the CPU at once.
+    images = torch.zeros((num_images, camera_model.ss.W * camera_model.ss.H, 3), device=device)
+    images.index_copy_(1, camera.valid_mask_flat_idx, out["feature"].view(num_images, -1, 3))
+    images = images.view(num_images, camera_model.ss.W, camera_model.ss.H, 3)
 
-    return all_images
+    return list(images.cpu().numpy())
 
 
 def render_images_in_poses(model, camera, pose_model, dataset, num_images = -1, save_traj=True, fix_heading=False):
@@ -101,15 +103,15 @@ def render_images_in_poses(model, camera, pose_model, dataset, num_images = -1,
         )
 
         # Render
-        ray_bundle = get_rays_from_pixels(pixel_coords, fish_camera_model, model.X_ned_cam, pose, debug=False)
+        ray_bundle = get_rays_from_pixels(pixel_coords, camera, model.X_ned_cam, pose, debug=False)
  
         # Run model forward
         out = model(ray_bundle)
 
-        # Return rendered features (colors)
-        mask = fish_camera_model.get_valid_mask().cpu()
-        image_fish = np.zeros((fish_camera_model.ss.W, fish_camera_model.ss.H, 3))
-        image_fish[mask == 1, :] = out["feature"].cpu().detach().numpy()
+        # Return rendered features (colors), scattered into the valid pixels on the GPU.
+        image_fish = torch.zeros((fish_camera_model.ss.W * fish_camera_model.ss.H, 3), device=out["feature"].device)
+        image_fish.index_copy_(0, camera.valid_mask_flat_idx, out["feature"])
+        image_fish = image_fish.view(fish_camera_model.ss.W, fish_camera_model.ss.H, 3)
 
         # ------------------------- Render projective ------------------------- #        
         pixel_coords, pixel_xys = get_pixels_from_image(
@@ -122,15 +124,18 @@ def render_images_in_poses(model, camera, pose_model, dataset, num_images = -1,
         # Run model forward
         out = model(ray_bundle)
 
-        image_proj = out["feature"].view(256,256,3).detach().cpu().numpy()
+        image_proj = out["feature"].view(256,256,3)
 
         # ------------------------- Save & Return ------------------------- #
-        # Concatenate the original images and the rendered images.
-        image_gt_viewed = image_gt.squeeze().permute(1,2,0).cpu()
-        image = np.concatenate((image_gt_viewed, image_fish, image_proj), axis=1)
+        # Concatenate the original images and the rendered images. They stay on the GPU until all the images are rendered.
+        image_gt_viewed = image_gt.squeeze().permute(1,2,0).to(image_fish.device)
+        image = torch.cat((image_gt_viewed, image_fish, image_proj), dim=1)
 
         all_images.append(image)
 
+    # Copy all the images to the CPU at once.
+    all_images = list(torch.stack(all_images).cpu().numpy())
+
 
     # ------------------------- Save trajectory as well ------------------------- #
     if save_traj: